@@ -1,29 +1,174 @@
+import io
+import multiprocessing
 import os
+import re
 import shutil
-from typing import Optional
-from markitdown import MarkItDown
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import List, Optional, Tuple
+
+# markitdown, pdfminer and pypdfium2 pull in heavy dependencies (lxml,
+# pandas, PIL, ...), so they are imported on first use rather than at startup
+
+# PDFs with fewer pages than this are extracted in-process
+PDF_PARALLEL_MIN_PAGES = 4
+
+# Patterns for MarkItDown-style output normalization
+_LINE_BREAK_RE = re.compile(r"\r?\n")
+_MULTI_NEWLINE_RE = re.compile(r"\n{3,}")
+
+_pdf_pool: Optional[ProcessPoolExecutor] = None
+# The pool is created and reset from threadpool workers
+_pdf_pool_lock = threading.Lock()
+
+
+def _get_pdf_pool() -> ProcessPoolExecutor:
+    """Get or create the process pool used for PDF page extraction."""
+    global _pdf_pool
+    with _pdf_pool_lock:
+        if _pdf_pool is None:
+            # Workers are spawned, not forked: forking this multithreaded
+            # server (torch/OpenMP, anyio workers) can deadlock the child.
+            # Spawned workers re-run the __main__ module, so the server is
+            # started via uvicorn rather than `python -m app.main`.
+            _pdf_pool = ProcessPoolExecutor(
+                max_workers=os.cpu_count(),
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return _pdf_pool
+
+
+def _reset_pdf_pool(pool: ProcessPoolExecutor) -> None:
+    """Drop a broken pool so the next call starts a fresh one."""
+    global _pdf_pool
+    with _pdf_pool_lock:
+        if _pdf_pool is pool:
+            _pdf_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def shutdown_pdf_pool() -> None:
+    """Shut down the PDF extraction pool if it was started."""
+    global _pdf_pool
+    with _pdf_pool_lock:
+        pool, _pdf_pool = _pdf_pool, None
+    if pool is not None:
+        pool.shutdown(cancel_futures=True)
+
+
+def _extract_pdf_pages(args: Tuple[bytes, List[int]]) -> str:
+    """Extract the text of a range of PDF pages (runs in a worker process)."""
+    import pdfminer.high_level
+
+    data, page_numbers = args
+    return pdfminer.high_level.extract_text(io.BytesIO(data), page_numbers=page_numbers)
 
 
 class ConversionService:
     def __init__(self):
-        self.markitdown = MarkItDown()
+        self._markitdown = None
+        # "pypdfium2" (fast, C++ PDFium) or "pdfminer" (MarkItDown's extractor)
+        self.pdf_converter = os.getenv("PDF_CONVERTER", "pypdfium2").lower()
+
+    @property
+    def markitdown(self):
+        """MarkItDown instance, created on first use."""
+        if self._markitdown is None:
+            from markitdown import MarkItDown
 
-    def convert_file(self, file_path: str) -> str:
+            self._markitdown = MarkItDown()
+        return self._markitdown
+
+    def convert_bytes(self, data: bytes, suffix: str) -> str:
         """
-        Convert a file to markdown using MarkItDown.
-        
+        Convert an in-memory file to markdown using MarkItDown.
+
         Args:
-            file_path: Path to the file to convert
-            
+            data: Raw file content
+            suffix: File extension including the dot (e.g. ".pdf")
+
         Returns:
             str: The converted markdown content
         """
         try:
-            result = self.markitdown.convert(file_path)
+            if suffix.lower() == ".pdf":
+                return self._convert_pdf(data)
+
+            result = self.markitdown.convert_stream(io.BytesIO(data), file_extension=suffix)
             return result.text_content
         except Exception as e:
             raise Exception(f"Failed to convert file: {str(e)}")
 
+    def _convert_pdf(self, data: bytes) -> str:
+        """
+        Extract PDF text with the configured PDF converter.
+
+        Args:
+            data: Raw PDF content
+
+        Returns:
+            str: The extracted text, normalized like MarkItDown output
+        """
+        if self.pdf_converter == "pdfminer":
+            text = self._extract_pdf_pdfminer(data)
+        else:
+            text = self._extract_pdf_pdfium(data)
+
+        # Same normalization MarkItDown applies to converter output
+        text = "\n".join(line.rstrip() for line in _LINE_BREAK_RE.split(text))
+        return _MULTI_NEWLINE_RE.sub("\n\n", text)
+
+    def _extract_pdf_pdfium(self, data: bytes) -> str:
+        """Extract PDF text page by page with PDFium."""
+        import pypdfium2 as pdfium
+
+        pdf = pdfium.PdfDocument(data)
+        try:
+            pages = []
+            for page in pdf:
+                textpage = page.get_textpage()
+                pages.append(textpage.get_text_bounded())
+                textpage.close()
+                page.close()
+            return "\n\n".join(pages)
+        finally:
+            pdf.close()
+
+    def _extract_pdf_pdfminer(self, data: bytes) -> str:
+        """
+        Extract PDF text with pdfminer, splitting the pages across a process pool.
+
+        pdfminer is what MarkItDown uses for PDFs, and each page's text ends
+        with a form feed, so joining the per-range results reproduces the
+        single-process output.
+        """
+        import pdfminer.high_level
+        from pdfminer.pdfpage import PDFPage
+
+        page_count = sum(1 for _ in PDFPage.get_pages(io.BytesIO(data)))
+
+        if page_count < PDF_PARALLEL_MIN_PAGES:
+            return pdfminer.high_level.extract_text(io.BytesIO(data))
+
+        # One contiguous page range per worker so each process parses the PDF once
+        workers = min(os.cpu_count() or 1, page_count)
+        step = -(-page_count // workers)
+        ranges = [
+            (data, list(range(start, min(start + step, page_count))))
+            for start in range(0, page_count, step)
+        ]
+        # A worker that died (e.g. OOM) breaks the whole pool, so it is
+        # replaced and the extraction retried once
+        for attempt in range(2):
+            pool = _get_pdf_pool()
+            try:
+                return "".join(pool.map(_extract_pdf_pages, ranges))
+            except BrokenProcessPool:
+                _reset_pdf_pool(pool)
+                if attempt:
+                    raise
+
 
 _conversion_service: Optional[ConversionService] = None
 
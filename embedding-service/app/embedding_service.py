@@ -1,8 +1,27 @@
-from typing import List
+import asyncio
+from collections import OrderedDict
+from contextlib import nullcontext, suppress
+from hashlib import blake2b
+from typing import Iterator, List, Optional, Tuple
+import diskcache
 import numpy as np
+import re
+import threading
+import torch
 from sentence_transformers import SentenceTransformer
+from sentence_transformers.quantization import quantize_embeddings
 import os
 
+# Characters chunk_text treats as sentence boundaries
+_SENT_RE = re.compile(r"[.!?\n]")
+
+# Parsed once so chunk_text does int arithmetic, not str, when the env is set
+_DEFAULT_CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", "500"))
+_DEFAULT_CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", "50"))
+
+# Values accepted for EMBEDDING_BACKEND
+_SUPPORTED_BACKENDS = ("torch", "onnx")
+
 class EmbeddingService:
     """Service for generating text embeddings using sentence-transformers"""
 
@@ -14,12 +33,119 @@ class EmbeddingService:
             model_name: Name of the sentence-transformer model to use
         """
         self.model_name = model_name
-        print(f"Loading embedding model: {model_name}...")
-        self.model = SentenceTransformer(model_name)
-        self.dimension = os.getenv("EMBEDDING_DIMENSION", 384)
+        self.device = os.getenv("EMBEDDING_DEVICE") or ("cuda" if torch.cuda.is_available() else "cpu")
+        self.backend = os.getenv("EMBEDDING_BACKEND", "torch").lower()
+        if self.backend not in _SUPPORTED_BACKENDS:
+            raise ValueError(
+                f"Unsupported EMBEDDING_BACKEND {self.backend!r}, expected one of: "
+                + ", ".join(_SUPPORTED_BACKENDS)
+            )
+        self.onnx_quantization = (
+            os.getenv("EMBEDDING_ONNX_QUANTIZATION") if self.backend == "onnx" else None
+        )
+        print(f"Loading embedding model: {model_name} on {self.device} ({self.backend})...")
+        if self.backend == "onnx":
+            self.model = self._load_onnx_model(model_name)
+        else:
+            self.model = SentenceTransformer(model_name, device=self.device, backend=self.backend)
+
+        # Half precision only pays off on GPU tensor cores
+        self.use_fp16 = (
+            self.backend == "torch"
+            and self.device.startswith("cuda")
+            and os.getenv("EMBEDDING_FP16", "false").lower() == "true"
+        )
+        if self.use_fp16:
+            self.model.half()
+
+        self.dimension = int(os.getenv("EMBEDDING_DIMENSION", "384"))
+        # Actual output width, used to preallocate encode() results
+        self._vector_size = self.model.get_sentence_embedding_dimension()
         print(f"Model loaded successfully. Embedding dimension: {self.dimension}")
 
-    def encode(self, texts: List[str]) -> List[List[float]]:
+        # sentence-transformers length-sorts the full input before batching,
+        # so a large batch size keeps per-batch overhead low
+        self.batch_size = int(os.getenv("ST_BATCH_SIZE", "1024"))
+
+        # Unit-length vectors let cosine consumers skip their own normalize pass
+        self.normalize = os.getenv("EMBEDDING_NORMALIZE", "true").lower() == "true"
+
+        if self.backend == "torch" and os.getenv("EMBEDDING_COMPILE", "false").lower() == "true":
+            self._compile_model()
+
+        # Optional .npy of reference embeddings fixing the int8 ranges, so
+        # quantized vectors are comparable across requests
+        calibration_path = os.getenv("EMBEDDING_INT8_CALIBRATION")
+        self.int8_calibration = np.load(calibration_path) if calibration_path else None
+
+        # LRU cache of text hash -> embedding, disabled when size is 0
+        self.cache_size = int(os.getenv("EMBEDDING_CACHE_SIZE", "0"))
+        self._cache: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        # encode() runs on threadpool workers, so cache access is serialized
+        self._cache_lock = threading.Lock()
+
+        # Optional persistent cache behind the LRU, shared across restarts
+        cache_dir = os.getenv("EMBEDDING_CACHE_DIR")
+        ttl = os.getenv("EMBEDDING_CACHE_TTL")
+        self.cache_ttl = float(ttl) if ttl else None
+        self._disk_cache = diskcache.Cache(cache_dir) if cache_dir else None
+
+    def _compile_model(self) -> None:
+        """
+        Compile the transformer with torch.compile to fuse its kernels.
+
+        A warmup encode triggers the compilation at startup instead of on the
+        first request; if it fails the eager module is restored.
+        """
+        auto_model = self.model[0].auto_model
+        try:
+            self.model[0].auto_model = torch.compile(auto_model, mode="reduce-overhead", dynamic=True)
+            self._encode_uncached(["warmup"])
+            print("Transformer compiled with torch.compile")
+        except Exception as e:
+            self.model[0].auto_model = auto_model
+            print(f"torch.compile failed, falling back to eager mode: {e}")
+
+    def _load_onnx_model(self, model_name: str) -> SentenceTransformer:
+        """
+        Load the model with the ONNX Runtime backend.
+
+        When EMBEDDING_ONNX_QUANTIZATION is set (e.g. "avx512_vnni", "avx2",
+        "arm64"), a dynamically int8-quantized copy is exported once into
+        EMBEDDING_ONNX_CACHE_DIR and loaded on subsequent launches.
+
+        Args:
+            model_name: Name of the sentence-transformer model to use
+
+        Returns:
+            SentenceTransformer running on ONNX Runtime
+        """
+        quantization = self.onnx_quantization
+        if not quantization:
+            return SentenceTransformer(model_name, device=self.device, backend="onnx")
+
+        from sentence_transformers import export_dynamic_quantized_onnx_model
+
+        cache_dir = os.path.join(
+            os.getenv("EMBEDDING_ONNX_CACHE_DIR", "/tmp/onnx-models"),
+            model_name.replace("/", "__"),
+        )
+        file_name = f"onnx/model_qint8_{quantization}.onnx"
+
+        if not os.path.exists(os.path.join(cache_dir, file_name)):
+            print(f"Exporting int8 {quantization} ONNX model to {cache_dir}...")
+            model = SentenceTransformer(model_name, device=self.device, backend="onnx")
+            model.save(cache_dir)
+            export_dynamic_quantized_onnx_model(model, quantization, cache_dir)
+
+        return SentenceTransformer(
+            cache_dir,
+            device=self.device,
+            backend="onnx",
+            model_kwargs={"file_name": file_name},
+        )
+
+    def encode(self, texts: List[str]) -> np.ndarray:
         """
         Generate embeddings for a list of texts.
 
@@ -27,35 +153,215 @@ class EmbeddingService:
             texts: List of text strings to encode
 
         Returns:
-            List of embedding vectors (each vector is a list of floats)
+            float32 array of shape (len(texts), dimension)
         """
         if not texts:
-            return []
+            return np.empty((0, self._vector_size), dtype=np.float32)
+
+        if self.cache_size <= 0 and self._disk_cache is None:
+            return self._encode_uncached(texts)
+
+        keys = [self._cache_key(text) for text in texts]
+        results = np.empty((len(texts), self._vector_size), dtype=np.float32)
+
+        # Serve hits from the cache and group misses by key so duplicate
+        # texts within one request are only encoded once
+        misses: "OrderedDict[str, List[int]]" = OrderedDict()
+        with self._cache_lock:
+            for idx, key in enumerate(keys):
+                cached = self._cache.get(key)
+                if cached is not None:
+                    self._cache.move_to_end(key)
+                    results[idx] = cached
+                else:
+                    misses.setdefault(key, []).append(idx)
+
+        # Memory misses fall back to the disk cache before the model
+        fetched: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        if misses and self._disk_cache is not None:
+            for key in list(misses):
+                data = self._disk_cache.get(key)
+                if data is not None:
+                    embedding = np.frombuffer(data, dtype=np.float32)
+                    results[misses.pop(key)] = embedding
+                    fetched[key] = embedding
+
+        if misses:
+            miss_texts = [texts[indices[0]] for indices in misses.values()]
+            embeddings = self._encode_uncached(miss_texts)
+            for (key, indices), embedding in zip(misses.items(), embeddings):
+                results[indices] = embedding
+                # Copy so cached rows don't keep the whole batch array alive
+                fetched[key] = embedding.copy()
+                if self._disk_cache is not None:
+                    self._disk_cache.set(key, embedding.tobytes(), expire=self.cache_ttl)
+
+        if fetched and self.cache_size > 0:
+            with self._cache_lock:
+                self._cache.update(fetched)
+
+                # Evict least recently used entries on overflow
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+
+        return results
+
+    def _encode_uncached(self, texts: List[str]) -> np.ndarray:
+        """Run the model on texts and return a float32 array."""
+        with torch.inference_mode(), self._autocast():
+            embeddings = self.model.encode(
+                texts,
+                batch_size=self.batch_size,
+                convert_to_numpy=True,
+                normalize_embeddings=self.normalize,
+                show_progress_bar=False,
+            )
+        return embeddings.astype(np.float32, copy=False)
+
+    def encode_tokens(
+        self, input_ids: List[List[int]], attention_mask: Optional[List[List[int]]] = None
+    ) -> np.ndarray:
+        """
+        Generate embeddings from pre-tokenized input, bypassing the tokenizer.
+
+        Args:
+            input_ids: Token ids per text, produced by this model's tokenizer
+            attention_mask: Attention mask per text (defaults to all ones)
+
+        Returns:
+            float32 array of shape (len(input_ids), dimension)
+        """
+        if not input_ids:
+            return np.empty((0, self._vector_size), dtype=np.float32)
+
+        if attention_mask is None:
+            attention_mask = [[1] * len(ids) for ids in input_ids]
+
+        max_seq_length = self.model.max_seq_length
+        pad_token_id = self.model.tokenizer.pad_token_id or 0
+        results = np.empty((len(input_ids), self._vector_size), dtype=np.float32)
+
+        for batch_start in range(0, len(input_ids), self.batch_size):
+            batch_ids = [ids[:max_seq_length] for ids in input_ids[batch_start:batch_start + self.batch_size]]
+            batch_mask = [mask[:max_seq_length] for mask in attention_mask[batch_start:batch_start + self.batch_size]]
+
+            # Right-pad ragged rows so the batch stacks into one tensor
+            width = max(len(ids) for ids in batch_ids)
+            ids_tensor = torch.full((len(batch_ids), width), pad_token_id, dtype=torch.long)
+            mask_tensor = torch.zeros((len(batch_ids), width), dtype=torch.long)
+            for row, (ids, mask) in enumerate(zip(batch_ids, batch_mask)):
+                ids_tensor[row, :len(ids)] = torch.tensor(ids, dtype=torch.long)
+                mask_tensor[row, :len(mask)] = torch.tensor(mask, dtype=torch.long)
+
+            features = {
+                "input_ids": ids_tensor.to(self.model.device),
+                "attention_mask": mask_tensor.to(self.model.device),
+            }
 
-        # Generate embeddings
-        embeddings = self.model.encode(texts, convert_to_numpy=True)
+            # Runs the transformer, pooling and any normalize module
+            with torch.inference_mode(), self._autocast():
+                embeddings = self.model(features)["sentence_embedding"]
+                if self.normalize:
+                    embeddings = torch.nn.functional.normalize(embeddings, p=2, dim=1)
 
-        # Convert numpy arrays to lists
-        return embeddings.tolist()
+            results[batch_start:batch_start + len(batch_ids)] = embeddings.float().cpu().numpy()
+
+        return results
+
+    def quantize(self, embeddings: np.ndarray, dtype: str) -> np.ndarray:
+        """
+        Convert embeddings to a compact dtype for transport or storage.
+
+        Args:
+            embeddings: Embedding vectors as returned by encode()
+            dtype: Target dtype, "float16" or "int8"
+
+        Returns:
+            Numpy array of shape (len(embeddings), dimension) in the target dtype
+        """
+        array = np.asarray(embeddings, dtype=np.float32)
+
+        if dtype == "float16":
+            return array.astype(np.float16)
+
+        if dtype == "int8":
+            if self.int8_calibration is not None:
+                return quantize_embeddings(
+                    array, precision="int8", calibration_embeddings=self.int8_calibration
+                )
+            # Ranges are never taken from the request's own batch: a single
+            # vector would have zero range, and scales would differ between
+            # requests. Unit-length components lie in [-1, 1], so a fixed
+            # symmetric scale keeps vectors comparable.
+            if not self.normalize:
+                raise ValueError(
+                    "int8 embeddings require EMBEDDING_NORMALIZE=true or EMBEDDING_INT8_CALIBRATION"
+                )
+            return np.clip(np.rint(array * 127), -127, 127).astype(np.int8)
+
+        raise ValueError(f"Unsupported embedding dtype: {dtype}")
+
+    def _autocast(self):
+        """fp16 autocast context on CUDA, a no-op otherwise."""
+        if self.use_fp16:
+            return torch.autocast("cuda", dtype=torch.float16)
+        return nullcontext()
+
+    def _cache_key(self, text: str) -> str:
+        """
+        Content hash used as the embedding cache key.
+
+        Covers everything that changes the produced vector (model, backend,
+        ONNX quantization, fp16, normalization), so a persistent disk cache
+        never serves vectors computed under a different configuration.
+        """
+        key = (
+            f"{self.model_name}|{self.backend}|{self.onnx_quantization}|"
+            f"{self.use_fp16}|{self.normalize}|{text}"
+        )
+        return blake2b(key.encode("utf-8"), digest_size=16).hexdigest()
 
     def chunk_text(
-        self, text: str, chunk_size: int = os.getenv("CHUNK_SIZE", 500), chunk_overlap: int = os.getenv("CHUNK_OVERLAP", 50)
+        self, text: str, chunk_size: Optional[int] = None, chunk_overlap: Optional[int] = None
     ) -> List[str]:
         """
         Split text into overlapping chunks.
 
         Args:
             text: Text to chunk
-            chunk_size: Size of each chunk in characters
-            chunk_overlap: Number of characters to overlap between chunks
+            chunk_size: Size of each chunk in characters (defaults to CHUNK_SIZE)
+            chunk_overlap: Number of characters to overlap between chunks (defaults to CHUNK_OVERLAP)
 
         Returns:
             List of text chunks
         """
+        if chunk_size is None:
+            chunk_size = _DEFAULT_CHUNK_SIZE
+        if chunk_overlap is None:
+            chunk_overlap = _DEFAULT_CHUNK_OVERLAP
+
+        # Otherwise the chunk start never advances
+        if chunk_size <= 0 or not 0 <= chunk_overlap < chunk_size:
+            raise ValueError("chunk_size must be positive and chunk_overlap in [0, chunk_size)")
+
         if not text:
             return []
 
-        chunks = []
+        # Texts that fit in one chunk need no boundary search
+        if len(text) <= chunk_size:
+            chunk = text.strip()
+            return [chunk] if chunk else []
+
+        return [text[start:end] for start, end in self._chunk_offsets(text, chunk_size, chunk_overlap)]
+
+    @staticmethod
+    def _chunk_offsets(text: str, chunk_size: int, chunk_overlap: int) -> Iterator[Tuple[int, int]]:
+        """
+        Yield the (start, end) offsets of each non-empty, whitespace-trimmed chunk.
+
+        Working on offsets means each chunk is sliced out of the original
+        text exactly once, rather than sliced and then copied again by strip().
+        """
         start = 0
         text_length = len(text)
 
@@ -66,27 +372,123 @@ class EmbeddingService:
             # If this is not the last chunk, try to break at a sentence boundary
             if end < text_length:
                 # Look for sentence endings within the next 100 characters
-                search_start = end
-                search_end = min(end + 100, text_length)
-                sentence_endings = [
-                    i
-                    for i, char in enumerate(text[search_start:search_end], start=search_start)
-                    if char in ".!?\n"
-                ]
-
-                if sentence_endings:
-                    end = sentence_endings[0] + 1
-
-            # Extract the chunk
-            chunk = text[start:end].strip()
-            if chunk:
-                chunks.append(chunk)
+                match = _SENT_RE.search(text, end, min(end + 100, text_length))
+                if match:
+                    end = match.end()
+
+            # Trim surrounding whitespace by moving the offsets inwards
+            chunk_start, chunk_end = start, min(end, text_length)
+            while chunk_start < chunk_end and text[chunk_start].isspace():
+                chunk_start += 1
+            while chunk_end > chunk_start and text[chunk_end - 1].isspace():
+                chunk_end -= 1
+
+            if chunk_start < chunk_end:
+                yield chunk_start, chunk_end
 
             # Move to the next chunk with overlap
             start = end - chunk_overlap if end < text_length else text_length
 
-        return chunks
-
     def get_dimension(self) -> int:
         """Get the dimension of the embedding vectors"""
         return self.dimension
+
+
+class EmbeddingBatcher:
+    """
+    Coalesces concurrent encode requests into a single model call.
+
+    Requests are queued and a background task drains up to max_batch_size
+    texts, waiting at most max_wait_ms for more to arrive, then runs one
+    EmbeddingService.encode() and hands each caller back its own slice.
+    """
+
+    def __init__(
+        self,
+        service: EmbeddingService,
+        max_batch_size: Optional[int] = None,
+        max_wait_ms: Optional[float] = None,
+    ):
+        """
+        Initialize the batcher.
+
+        Args:
+            service: Embedding service used to run the merged batches
+            max_batch_size: Maximum texts per merged batch (EMBEDDING_MAX_BATCH)
+            max_wait_ms: Maximum time to wait for more requests (EMBEDDING_MAX_WAIT_MS)
+        """
+        self.service = service
+        self.max_batch_size = max_batch_size or int(os.getenv("EMBEDDING_MAX_BATCH", "256"))
+        if max_wait_ms is None:
+            max_wait_ms = float(os.getenv("EMBEDDING_MAX_WAIT_MS", "5"))
+        self.max_wait = max_wait_ms / 1000
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        """Start the background consumer on the running event loop."""
+        self._queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stop the consumer and fail any requests still waiting."""
+        if self._task is not None:
+            self._task.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+
+        while self._queue is not None and not self._queue.empty():
+            _, future = self._queue.get_nowait()
+            if not future.done():
+                future.set_exception(RuntimeError("Embedding batcher stopped"))
+
+    async def encode(self, texts: List[str]) -> np.ndarray:
+        """
+        Queue texts for the next merged batch and wait for their embeddings.
+
+        Args:
+            texts: List of text strings to encode
+
+        Returns:
+            float32 array of embeddings, in the order of texts
+        """
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((texts, future))
+        return await future
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+
+        while True:
+            items = [await self._queue.get()]
+            count = len(items[0][0])
+            deadline = loop.time() + self.max_wait
+
+            # Keep collecting until the batch is full or the wait expires
+            while count < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                items.append(item)
+                count += len(item[0])
+
+            texts = [text for batch, _ in items for text in batch]
+            try:
+                embeddings = await asyncio.to_thread(self.service.encode, texts)
+            except Exception as e:
+                for _, future in items:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            offset = 0
+            for batch, future in items:
+                # Callers that went away leave cancelled futures behind
+                if not future.done():
+                    future.set_result(embeddings[offset:offset + len(batch)])
+                offset += len(batch)
@@ -1,25 +1,41 @@
+import base64
 import os
-from typing import List
+from typing import List, Literal, Optional
 from contextlib import asynccontextmanager
 
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# OpenMP/MKL read their thread counts when torch is first imported, so these
+# must be set before the imports below
+TORCH_NUM_THREADS = int(os.getenv("TORCH_NUM_THREADS", str(os.cpu_count() or 1)))
+os.environ.setdefault("OMP_NUM_THREADS", str(TORCH_NUM_THREADS))
+os.environ.setdefault("MKL_NUM_THREADS", str(TORCH_NUM_THREADS))
+
+import torch
+
+# Set once per process: set_num_interop_threads raises if called again, so
+# this can't live in lifespan, which may run more than once (e.g. tests)
+torch.set_num_threads(TORCH_NUM_THREADS)
+torch.set_num_interop_threads(1)
+
 from fastapi import FastAPI, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel
-from dotenv import load_dotenv
 
-from app.embedding_service import EmbeddingService
-from app.search_service import get_search_service
-from app.normalize_service import get_normalize_service
-from app.conversion_service import get_conversion_service
+from app.embedding_service import EmbeddingBatcher, EmbeddingService
+from app.search_service import get_search_service, shutdown_search_service
+from app.normalize_service import get_normalize_service, shutdown_normalize_pool
+from app.conversion_service import get_conversion_service, shutdown_pdf_pool
 from fastapi import UploadFile, File
-import tempfile
-import shutil
-
-# Load environment variables
-load_dotenv()
 
 # Global services
 embedding_service = None
+embedding_batcher = None
 search_service = None
 normalize_service = None
 conversion_service = None
@@ -28,19 +44,25 @@ conversion_service = None
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup: Initialize services
-    global embedding_service, search_service, normalize_service, conversion_service
+    global embedding_service, embedding_batcher, search_service, normalize_service, conversion_service
     model_name = os.getenv("EMBEDDING_MODEL", "all-MiniLM-L6-v2")
     embedding_service = EmbeddingService(model_name)
+    embedding_batcher = EmbeddingBatcher(embedding_service)
+    await embedding_batcher.start()
     search_service = get_search_service()
     normalize_service = get_normalize_service()
     conversion_service = get_conversion_service()
-    print(f"Embedding service initialized with model: {model_name}")
+    print(f"Embedding service initialized with model: {model_name} ({TORCH_NUM_THREADS} threads)")
     print("Search service initialized")
     print("Normalize service initialized")
     print("Conversion service initialized")
     yield
     # Shutdown: cleanup if needed
     print("Shutting down services")
+    await embedding_batcher.stop()
+    await shutdown_search_service()
+    shutdown_pdf_pool()
+    shutdown_normalize_pool()
 
 
 # Create FastAPI app
@@ -48,6 +70,7 @@ app = FastAPI(
     title=os.getenv("APP_NAME", "Document Hub Embedding Service"),
     version="1.0.0",
     lifespan=lifespan,
+    default_response_class=ORJSONResponse,
 )
 
 # CORS middleware
@@ -63,18 +86,32 @@ app.add_middleware(
 # Request/Response models
 class EmbeddingRequest(BaseModel):
     texts: List[str]
+    dtype: Literal["float32", "float16", "int8"] = "float32"
+
+
+class TokenEmbeddingRequest(BaseModel):
+    input_ids: List[List[int]]
+    attention_mask: Optional[List[List[int]]] = None
 
 
 class EmbeddingResponse(BaseModel):
     embeddings: List[List[float]]
     model: str
     dimension: int
+    # For float16/int8 the vectors are sent as raw little-endian bytes instead:
+    # np.frombuffer(base64.b64decode(embeddings_b64), dtype=dtype).reshape(shape)
+    dtype: str = "float32"
+    embeddings_b64: Optional[str] = None
+    shape: Optional[List[int]] = None
+    # True when vectors are already unit length (EMBEDDING_NORMALIZE)
+    normalized: bool = False
 
 
 class ChunkRequest(BaseModel):
     text: str
-    chunk_size: int = 500
-    chunk_overlap: int = 50
+    # None falls back to the CHUNK_SIZE / CHUNK_OVERLAP environment defaults
+    chunk_size: Optional[int] = None
+    chunk_overlap: Optional[int] = None
 
 
 class ChunkResponse(BaseModel):
@@ -158,12 +195,63 @@ async def generate_embeddings(request: EmbeddingRequest):
         raise HTTPException(status_code=400, detail="No texts provided")
 
     try:
-        embeddings = embedding_service.encode(request.texts)
-        return EmbeddingResponse(
-            embeddings=embeddings,
-            model=embedding_service.model_name,
-            dimension=embedding_service.dimension,
+        # Concurrent requests are merged into one model call by the batcher
+        embeddings = await embedding_batcher.encode(request.texts)
+
+        if request.dtype != "float32":
+            quantized = await run_in_threadpool(embedding_service.quantize, embeddings, request.dtype)
+            return ORJSONResponse({
+                "embeddings": [],
+                "model": embedding_service.model_name,
+                "dimension": embedding_service.dimension,
+                "dtype": request.dtype,
+                "embeddings_b64": base64.b64encode(quantized.tobytes()).decode("ascii"),
+                "shape": list(quantized.shape),
+                "normalized": embedding_service.normalize,
+            })
+
+        # orjson serializes the numpy array directly, skipping both the
+        # per-float Python objects and pydantic validation
+        return ORJSONResponse({
+            "embeddings": embeddings,
+            "model": embedding_service.model_name,
+            "dimension": embedding_service.dimension,
+            "dtype": "float32",
+            "normalized": embedding_service.normalize,
+        })
+    except ValueError as e:
+        # dtype not supported by this server's configuration
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to generate embeddings: {str(e)}")
+
+
+# Generate embeddings from pre-tokenized input endpoint
+@app.post("/api/v1/embeddings-tokens", response_model=EmbeddingResponse)
+async def generate_token_embeddings(request: TokenEmbeddingRequest):
+    if not embedding_service:
+        raise HTTPException(status_code=503, detail="Embedding service not initialized")
+
+    if not request.input_ids:
+        raise HTTPException(status_code=400, detail="No input_ids provided")
+
+    if request.attention_mask is not None and (
+        len(request.attention_mask) != len(request.input_ids)
+        or any(len(m) != len(i) for m, i in zip(request.attention_mask, request.input_ids))
+    ):
+        raise HTTPException(status_code=400, detail="attention_mask must match the shape of input_ids")
+
+    try:
+        embeddings = await run_in_threadpool(
+            embedding_service.encode_tokens, request.input_ids, request.attention_mask
         )
+        return ORJSONResponse({
+            "embeddings": embeddings,
+            "model": embedding_service.model_name,
+            "dimension": embedding_service.dimension,
+            "dtype": "float32",
+            "normalized": embedding_service.normalize,
+        })
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to generate embeddings: {str(e)}")
 
@@ -178,12 +266,15 @@ async def chunk_text(request: ChunkRequest):
         raise HTTPException(status_code=400, detail="No text provided")
 
     try:
-        chunks = embedding_service.chunk_text(
+        chunks = await run_in_threadpool(
+            embedding_service.chunk_text,
             request.text,
             chunk_size=request.chunk_size,
             chunk_overlap=request.chunk_overlap,
         )
         return ChunkResponse(chunks=chunks)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to chunk text: {str(e)}")
 
@@ -236,11 +327,12 @@ async def normalize_text(request: NormalizeRequest):
         raise HTTPException(status_code=400, detail="No text provided")
 
     try:
-        normalized = normalize_service.normalize_text(
+        normalized = await run_in_threadpool(
+            normalize_service.normalize_text,
             text=request.text,
             clean_html_tags=request.clean_html_tags,
         )
-        metadata = normalize_service.extract_metadata(normalized)
+        metadata = await run_in_threadpool(normalize_service.extract_metadata, normalized)
         return NormalizeResponse(normalized_text=normalized, metadata=metadata)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to normalize text: {str(e)}")
@@ -255,7 +347,8 @@ async def normalize_batch(request: NormalizeBatchRequest):
         raise HTTPException(status_code=400, detail="No texts provided")
 
     try:
-        normalized = normalize_service.normalize_batch(
+        normalized = await run_in_threadpool(
+            normalize_service.normalize_batch_parallel,
             texts=request.texts,
             deduplicate=request.deduplicate,
             clean_html_tags=request.clean_html_tags,
@@ -275,25 +368,22 @@ async def convert_document(file: UploadFile = File(...)):
     if not conversion_service:
         raise HTTPException(status_code=503, detail="Conversion service not initialized")
 
-    # Create a temporary file to save the uploaded content
-    with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(file.filename)[1]) as temp_file:
-        shutil.copyfileobj(file.file, temp_file)
-        temp_path = temp_file.name
+    # Convert straight from memory instead of round-tripping through a temp file
+    data = await file.read()
+    suffix = os.path.splitext(file.filename)[1]
 
     try:
-        markdown_content = conversion_service.convert_file(temp_path)
+        markdown_content = await run_in_threadpool(conversion_service.convert_bytes, data, suffix)
         return ConvertResponse(
             markdown=markdown_content,
             filename=file.filename
         )
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to convert document: {str(e)}")
-    finally:
-        # Clean up the temporary file
-        if os.path.exists(temp_path):
-            os.remove(temp_path)
 
 
+# Prefer `uvicorn app.main:app`: when this module is run as __main__, every
+# spawned PDF/normalize pool worker re-imports it, torch included
 if __name__ == "__main__":
     import uvicorn
 
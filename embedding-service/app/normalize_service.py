@@ -4,13 +4,118 @@ Handles HTML cleaning, deduplication, and format standardization.
 """
 
 import re
-from typing import List, Dict, Set
-from difflib import SequenceMatcher
+import os
+import multiprocessing
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+from typing import List, Dict, Optional, Set, Tuple
 import html
 import logging
 
+import numpy as np
+from datasketch import MinHash, MinHashLSH
+from rapidfuzz import fuzz, process
+
 logger = logging.getLogger(__name__)
 
+# Patterns used by normalize_text, compiled once
+_HTML_TAG_RE = re.compile(r'<[^>]+>')
+_MD_LINK_RE = re.compile(r'\[([^\]]+)\]\([^\)]+\)')
+_MD_IMAGE_RE = re.compile(r'!\[([^\]]*)\]\([^\)]+\)')
+_MD_HEADER_RE = re.compile(r'^#+\s+', re.MULTILINE)
+_MD_EMPHASIS_RE = re.compile(r'[*_]{1,3}([^*_]+)[*_]{1,3}')
+_MD_CODE_BLOCK_RE = re.compile(r'```[^`]*```', re.DOTALL)
+_MD_INLINE_CODE_RE = re.compile(r'`([^`]+)`')
+_MULTI_SPACE_RE = re.compile(r' +')
+_MULTI_NEWLINE_RE = re.compile(r'\n{3,}')
+
+# Probes used by extract_metadata
+_URL_RE = re.compile(r'https?://')
+_CODE_RE = re.compile(r'```|`[^`]+`')
+
+# Common problematic characters and their replacements
+_CHAR_REPLACEMENTS = {
+    '\u2018': "'",  # Left single quote
+    '\u2019': "'",  # Right single quote
+    '\u201c': '"',  # Left double quote
+    '\u201d': '"',  # Right double quote
+    '\u2013': '-',  # En dash
+    '\u2014': '-',  # Em dash
+    '\u2026': '...',  # Ellipsis
+}
+
+# Control characters (removed) and replaced characters in a single pass
+_SPECIAL_CHARS_RE = re.compile(
+    '[\x00-\x08\x0b-\x0c\x0e-\x1f\x7f-\x9f'
+    + ''.join(_CHAR_REPLACEMENTS)
+    + ']'
+)
+
+# ASCII text can only contain control characters, which str.translate
+# deletes much faster than a regex sub
+_ASCII_CONTROL_TABLE = str.maketrans(dict.fromkeys(
+    [*range(0x00, 0x09), 0x0b, 0x0c, *range(0x0e, 0x20), 0x7f]
+))
+
+# Anything normalize_text could change: HTML, markdown markers, special
+# characters, runs of spaces/newlines. Leading/trailing whitespace is
+# checked separately.
+_NEEDS_WORK_RE = re.compile(
+    '[<&\\[#*_`\x00-\x08\x0b-\x0c\x0e-\x1f\x7f-\x9f'
+    + ''.join(_CHAR_REPLACEMENTS)
+    + ']|  |\n\n\n'
+)
+
+# Batches with fewer texts than this are normalized in-process
+NORMALIZE_PARALLEL_MIN_TEXTS = 256
+
+_normalize_pool: Optional[ProcessPoolExecutor] = None
+# The pool is created and reset from threadpool workers
+_normalize_pool_lock = threading.Lock()
+
+
+def _get_normalize_pool() -> ProcessPoolExecutor:
+    """Get or create the process pool used for batch normalization."""
+    global _normalize_pool
+    with _normalize_pool_lock:
+        if _normalize_pool is None:
+            # Workers are spawned, not forked: forking this multithreaded
+            # server (torch/OpenMP, anyio workers) can deadlock the child.
+            # Spawned workers re-run the __main__ module, so the server is
+            # started via uvicorn rather than `python -m app.main`.
+            _normalize_pool = ProcessPoolExecutor(
+                max_workers=os.cpu_count(),
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return _normalize_pool
+
+
+def _reset_normalize_pool(pool: ProcessPoolExecutor) -> None:
+    """Drop a broken pool so the next call starts a fresh one."""
+    global _normalize_pool
+    with _normalize_pool_lock:
+        if _normalize_pool is pool:
+            _normalize_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def shutdown_normalize_pool() -> None:
+    """Shut down the normalization pool if it was started."""
+    global _normalize_pool
+    with _normalize_pool_lock:
+        pool, _normalize_pool = _normalize_pool, None
+    if pool is not None:
+        pool.shutdown(cancel_futures=True)
+
+
+def _normalize_worker(text: str, clean_html_tags: bool) -> str:
+    """Normalize a single text (runs in a worker process)."""
+    return get_normalize_service().normalize_text(text, clean_html_tags=clean_html_tags)
+
 
 class NormalizeService:
     """Service for normalizing and cleaning text content."""
@@ -18,7 +123,14 @@ class NormalizeService:
     def __init__(
         self,
         similarity_threshold: float = 0.85,
-        min_text_length: int = 50
+        min_text_length: int = 50,
+        lsh_threshold: float = 0.5,
+        lsh_num_perm: int = 128,
+        lsh_min_texts: int = 16384,
+        shingle_size: int = 5,
+        simhash_max_distance: int = 18,
+        simhash_ngram_size: int = 3,
+        similarity_cache_size: int = 65536
     ):
         """
         Initialize the normalization service.
@@ -26,9 +138,32 @@ class NormalizeService:
         Args:
             similarity_threshold: Threshold for fuzzy duplicate detection (0-1)
             min_text_length: Minimum text length to keep (in characters)
+            lsh_threshold: Shingle Jaccard similarity at which texts become
+                candidates for the exact similarity check (0-1)
+            lsh_num_perm: Number of MinHash permutations
+            lsh_min_texts: Batches smaller than this are compared exhaustively
+            shingle_size: Character shingle length used for MinHash
+            simhash_max_distance: Texts whose 64-bit SimHashes differ in more
+                bits than this are never compared
+            simhash_ngram_size: Character n-gram length used for SimHash
+            similarity_cache_size: Number of text pair scores kept across
+                calls, 0 to disable
         """
         self.similarity_threshold = similarity_threshold
         self.min_text_length = min_text_length
+        self.lsh_threshold = lsh_threshold
+        self.lsh_num_perm = lsh_num_perm
+        self.lsh_min_texts = lsh_min_texts
+        self.shingle_size = shingle_size
+        self.simhash_max_distance = simhash_max_distance
+        self.simhash_ngram_size = simhash_ngram_size
+
+        # LRU of (digest, digest) -> similarity ratio, so pairs recurring
+        # across batches are only scored once
+        self.similarity_cache_size = similarity_cache_size
+        self._similarity_cache: "OrderedDict[Tuple[bytes, bytes], float]" = OrderedDict()
+        # Batches are deduplicated on threadpool workers, so cache access is serialized
+        self._similarity_cache_lock = threading.Lock()
 
     def clean_html(self, text: str) -> str:
         """
@@ -44,7 +179,7 @@ class NormalizeService:
         text = html.unescape(text)
 
         # Remove HTML tags
-        text = re.sub(r'<[^>]+>', '', text)
+        text = _HTML_TAG_RE.sub('', text)
 
         return text
 
@@ -59,20 +194,20 @@ class NormalizeService:
             Cleaned text
         """
         # Remove markdown links but keep link text
-        text = re.sub(r'\[([^\]]+)\]\([^\)]+\)', r'\1', text)
+        text = _MD_LINK_RE.sub(r'\1', text)
 
         # Remove markdown images
-        text = re.sub(r'!\[([^\]]*)\]\([^\)]+\)', '', text)
+        text = _MD_IMAGE_RE.sub('', text)
 
         # Remove markdown headers (#)
-        text = re.sub(r'^#+\s+', '', text, flags=re.MULTILINE)
+        text = _MD_HEADER_RE.sub('', text)
 
         # Remove bold/italic markers
-        text = re.sub(r'[*_]{1,3}([^*_]+)[*_]{1,3}', r'\1', text)
+        text = _MD_EMPHASIS_RE.sub(r'\1', text)
 
         # Remove code blocks
-        text = re.sub(r'```[^`]*```', '', text, flags=re.DOTALL)
-        text = re.sub(r'`([^`]+)`', r'\1', text)
+        text = _MD_CODE_BLOCK_RE.sub('', text)
+        text = _MD_INLINE_CODE_RE.sub(r'\1', text)
 
         return text
 
@@ -87,10 +222,10 @@ class NormalizeService:
             Text with normalized whitespace
         """
         # Replace multiple spaces with single space
-        text = re.sub(r' +', ' ', text)
+        text = _MULTI_SPACE_RE.sub(' ', text)
 
         # Replace multiple newlines with maximum 2
-        text = re.sub(r'\n{3,}', '\n\n', text)
+        text = _MULTI_NEWLINE_RE.sub('\n\n', text)
 
         # Remove trailing/leading whitespace
         text = text.strip()
@@ -107,24 +242,14 @@ class NormalizeService:
         Returns:
             Cleaned text
         """
-        # Remove control characters
-        text = re.sub(r'[\x00-\x08\x0b-\x0c\x0e-\x1f\x7f-\x9f]', '', text)
-
-        # Replace common problematic characters
-        replacements = {
-            '\u2018': "'",  # Left single quote
-            '\u2019': "'",  # Right single quote
-            '\u201c': '"',  # Left double quote
-            '\u201d': '"',  # Right double quote
-            '\u2013': '-',  # En dash
-            '\u2014': '-',  # Em dash
-            '\u2026': '...',  # Ellipsis
-        }
-
-        for old, new in replacements.items():
-            text = text.replace(old, new)
+        if text.isascii():
+            return text.translate(_ASCII_CONTROL_TABLE)
 
-        return text
+        # Remove control characters and replace common problematic
+        # characters in one pass
+        return _SPECIAL_CHARS_RE.sub(
+            lambda m: _CHAR_REPLACEMENTS.get(m.group(0), ''), text
+        )
 
     def normalize_text(self, text: str, clean_html_tags: bool = True) -> str:
         """
@@ -140,6 +265,14 @@ class NormalizeService:
         if not text:
             return ""
 
+        # Already clean text is returned as-is
+        if (
+            not _NEEDS_WORK_RE.search(text)
+            and not text[0].isspace()
+            and not text[-1].isspace()
+        ):
+            return text
+
         # Clean HTML if requested
         if clean_html_tags:
             text = self.clean_html(text)
@@ -157,7 +290,8 @@ class NormalizeService:
 
     def calculate_similarity(self, text1: str, text2: str) -> float:
         """
-        Calculate similarity between two texts using sequence matching.
+        Calculate similarity between two texts using the normalized InDel
+        (LCS-based) ratio.
 
         Args:
             text1: First text
@@ -170,7 +304,107 @@ class NormalizeService:
         t1 = text1.lower().strip()
         t2 = text2.lower().strip()
 
-        return SequenceMatcher(None, t1, t2).ratio()
+        return self._score_candidates(t1, self._digest(t1), [(t2, self._digest(t2))])[0] / 100.0
+
+    def _digest(self, normalized: str) -> bytes:
+        """Hash a normalized text into the key used by the similarity cache."""
+        return hashlib.blake2b(normalized.encode("utf-8"), digest_size=16).digest()
+
+    def _ratios(self, normalized: str, texts: List[str]) -> List[float]:
+        """Score a text against several texts, processing the query once."""
+        if not texts:
+            return []
+        return process.cdist([normalized], texts, scorer=fuzz.ratio, dtype=np.float64)[0].tolist()
+
+    def _score_candidates(
+        self,
+        normalized: str,
+        digest: bytes,
+        candidates: List[Tuple[str, bytes]]
+    ) -> List[float]:
+        """
+        Score a text against candidates, reusing cached pair scores.
+
+        Args:
+            normalized: Lowercased, stripped text
+            digest: Digest of the text
+            candidates: (normalized text, digest) pairs to compare against
+
+        Returns:
+            fuzz.ratio score (0-100) for each candidate
+        """
+        if self.similarity_cache_size <= 0:
+            return self._ratios(normalized, [text for text, _ in candidates])
+
+        # Keys are ordered so (a, b) and (b, a) share an entry
+        keys = [
+            (digest, other) if digest <= other else (other, digest)
+            for _, other in candidates
+        ]
+        scores: List[Optional[float]] = [None] * len(candidates)
+        with self._similarity_cache_lock:
+            for i, key in enumerate(keys):
+                cached = self._similarity_cache.get(key)
+                if cached is not None:
+                    self._similarity_cache.move_to_end(key)
+                    scores[i] = cached
+
+        misses = [i for i, score in enumerate(scores) if score is None]
+        if misses:
+            computed = self._ratios(normalized, [candidates[i][0] for i in misses])
+            with self._similarity_cache_lock:
+                for i, score in zip(misses, computed):
+                    scores[i] = score
+                    self._similarity_cache[keys[i]] = score
+
+                # Evict least recently used entries on overflow
+                while len(self._similarity_cache) > self.similarity_cache_size:
+                    self._similarity_cache.popitem(last=False)
+
+        return scores
+
+    def _minhash(self, normalized: str) -> MinHash:
+        """
+        Build a MinHash sketch over the character shingles of a text.
+
+        Args:
+            normalized: Lowercased, stripped text
+
+        Returns:
+            MinHash of the text's shingles
+        """
+        size = self.shingle_size
+        minhash = MinHash(num_perm=self.lsh_num_perm)
+        minhash.update_batch([
+            normalized[i:i + size].encode("utf-8")
+            for i in range(max(1, len(normalized) - size + 1))
+        ])
+        return minhash
+
+    def _simhash(self, normalized: str) -> int:
+        """
+        Build a 64-bit SimHash over the character n-grams of a text.
+
+        Args:
+            normalized: Lowercased, stripped text
+
+        Returns:
+            SimHash of the text's n-grams as an int
+        """
+        size = self.simhash_ngram_size
+        grams = {
+            normalized[i:i + size]
+            for i in range(max(1, len(normalized) - size + 1))
+        }
+        digests = b''.join(
+            hashlib.blake2b(gram.encode("utf-8"), digest_size=8).digest()
+            for gram in grams
+        )
+
+        # Each bit is set when the majority of n-gram hashes have it set
+        bits = np.unpackbits(np.frombuffer(digests, dtype=np.uint8).reshape(-1, 8), axis=1)
+        votes = bits.sum(axis=0, dtype=np.int64) * 2 > len(grams)
+        return int.from_bytes(np.packbits(votes).tobytes(), "big")
 
     def deduplicate_texts(
         self,
@@ -191,39 +425,81 @@ class NormalizeService:
             return [] if not return_indices else {"texts": [], "removed_indices": []}
 
         unique_texts = []
+        unique_normalized = []
+        unique_lengths: List[int] = []
+        unique_simhashes: List[int] = []
+        unique_digests: List[bytes] = []
         removed_indices = []
         seen_signatures: Set[str] = set()
 
+        # For very large batches, only texts sharing a MinHash LSH band with
+        # an earlier text are compared, instead of every kept text. Building
+        # the MinHashes costs more than the SimHash-filtered exhaustive scan
+        # until batches reach roughly 16k texts.
+        lsh = None
+        if len(texts) >= self.lsh_min_texts:
+            lsh = MinHashLSH(threshold=self.lsh_threshold, num_perm=self.lsh_num_perm)
+
         for idx, text in enumerate(texts):
             # Skip very short texts
             if len(text) < self.min_text_length:
                 removed_indices.append(idx)
                 continue
 
-            # Create a signature for exact duplicate detection
-            signature = text.lower().strip()[:200]  # First 200 chars
+            # strip() returns the text itself when there is nothing to strip
+            stripped = text.strip()
+
+            # Create a signature for exact duplicate detection, lowering only
+            # the prefix so exact duplicates never lower the full text
+            signature = stripped[:200].lower()  # First 200 chars
 
             # Check exact duplicates
             if signature in seen_signatures:
                 removed_indices.append(idx)
                 continue
 
+            # Normalized buffer shared by the shingles and the similarity check
+            normalized = stripped.lower()
+
+            if lsh is not None:
+                minhash = self._minhash(normalized)
+                indices = sorted(lsh.query(minhash))
+            else:
+                indices = range(len(unique_normalized))
+
+            # The ratio of two texts can't exceed 2 * min(len) / (len1 + len2),
+            # so skip candidates whose length alone rules out a match. Texts
+            # whose SimHashes are too far apart are skipped as well.
+            length = len(normalized)
+            simhash = self._simhash(normalized)
+            threshold = self.similarity_threshold
+            max_distance = self.simhash_max_distance
+            candidates = [
+                (unique_normalized[i], unique_digests[i])
+                for i in indices
+                if 2 * min(length, unique_lengths[i]) >= threshold * (length + unique_lengths[i])
+                and (simhash ^ unique_simhashes[i]).bit_count() <= max_distance
+            ]
+
             # Check fuzzy duplicates against existing unique texts
-            is_duplicate = False
-            for existing in unique_texts:
-                similarity = self.calculate_similarity(text, existing)
-                if similarity >= self.similarity_threshold:
-                    is_duplicate = True
-                    removed_indices.append(idx)
-                    logger.debug(
-                        f"Removing duplicate (similarity: {similarity:.2f}): "
-                        f"{text[:50]}..."
-                    )
-                    break
-
-            if not is_duplicate:
-                unique_texts.append(text)
-                seen_signatures.add(signature)
+            digest = self._digest(normalized)
+            best = max(self._score_candidates(normalized, digest, candidates), default=0.0)
+            if best >= threshold * 100:
+                removed_indices.append(idx)
+                logger.debug(
+                    f"Removing duplicate (similarity: {best / 100:.2f}): "
+                    f"{text[:50]}..."
+                )
+                continue
+
+            if lsh is not None:
+                lsh.insert(len(unique_texts), minhash)
+            unique_texts.append(text)
+            unique_normalized.append(normalized)
+            unique_lengths.append(length)
+            unique_simhashes.append(simhash)
+            unique_digests.append(digest)
+            seen_signatures.add(signature)
 
         logger.info(
             f"Deduplicated {len(texts)} texts to {len(unique_texts)} "
@@ -263,6 +539,63 @@ class NormalizeService:
             for text in texts
         ]
 
+        return self._filter_batch(normalized, deduplicate)
+
+    def normalize_batch_parallel(
+        self,
+        texts: List[str],
+        deduplicate: bool = True,
+        clean_html_tags: bool = True
+    ) -> List[str]:
+        """
+        Normalize a batch of texts, spreading the per-text normalization
+        across a process pool. Deduplication runs afterwards in this process.
+
+        Args:
+            texts: List of texts to normalize
+            deduplicate: Whether to remove duplicates
+            clean_html_tags: Whether to clean HTML
+
+        Returns:
+            List of normalized texts
+        """
+        if len(texts) < NORMALIZE_PARALLEL_MIN_TEXTS:
+            return self.normalize_batch(
+                texts, deduplicate=deduplicate, clean_html_tags=clean_html_tags
+            )
+
+        # A few chunks per worker keeps the pickling overhead low while
+        # still balancing uneven text sizes
+        workers = os.cpu_count() or 1
+        # A worker that died breaks the whole pool, so it is replaced and
+        # the batch retried once
+        for attempt in range(2):
+            pool = _get_normalize_pool()
+            try:
+                normalized = list(pool.map(
+                    partial(_normalize_worker, clean_html_tags=clean_html_tags),
+                    texts,
+                    chunksize=max(1, len(texts) // (workers * 4))
+                ))
+                break
+            except BrokenProcessPool:
+                _reset_normalize_pool(pool)
+                if attempt:
+                    raise
+
+        return self._filter_batch(normalized, deduplicate)
+
+    def _filter_batch(self, normalized: List[str], deduplicate: bool) -> List[str]:
+        """
+        Drop empty/short texts from a normalized batch and optionally deduplicate.
+
+        Args:
+            normalized: Normalized texts
+            deduplicate: Whether to remove duplicates
+
+        Returns:
+            Filtered list of texts
+        """
         # Filter out empty texts
         normalized = [t for t in normalized if t and len(t) >= self.min_text_length]
 
@@ -285,10 +618,10 @@ class NormalizeService:
         metadata = {
             "character_count": len(text),
             "word_count": len(text.split()),
-            "line_count": len(text.split('\n')),
-            "has_html": bool(re.search(r'<[^>]+>', text)),
-            "has_urls": bool(re.search(r'https?://', text)),
-            "has_code": bool(re.search(r'```|`[^`]+`', text)),
+            "line_count": text.count('\n') + 1,
+            "has_html": bool(_HTML_TAG_RE.search(text)),
+            "has_urls": bool(_URL_RE.search(text)),
+            "has_code": bool(_CODE_RE.search(text)),
         }
 
         # Estimate reading time (average 200 words per minute)
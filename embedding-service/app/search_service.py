@@ -4,29 +4,205 @@ Supports DuckDuckGo search with web scraping capabilities.
 """
 
 import asyncio
+import html
 import re
-from typing import List, Dict, Optional
-from urllib.parse import quote_plus
+import time
+from collections import OrderedDict
+from typing import Any, List, Dict, Optional, Tuple
+from urllib.parse import parse_qsl, quote_plus, urlencode, urlsplit, urlunsplit
 import httpx
-from bs4 import BeautifulSoup
+from selectolax.lexbor import LexborHTMLParser
 import logging
 
 logger = logging.getLogger(__name__)
 
+_WS_RE = re.compile(r'\s+')
+
+
+def _canonical_url(url: str) -> str:
+    """
+    Normalize a URL for use as a cache key.
+
+    Lowercases the scheme and host, drops the fragment, utm_* tracking
+    parameters and any trailing slash, so equivalent URLs share a cache entry.
+
+    Args:
+        url: URL to normalize
+
+    Returns:
+        Normalized URL
+    """
+    parts = urlsplit(url)
+    query = urlencode([
+        (key, value)
+        for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if not key.lower().startswith('utm_')
+    ])
+    return urlunsplit((
+        parts.scheme.lower(),
+        parts.netloc.lower(),
+        parts.path.rstrip('/'),
+        query,
+        ''
+    ))
+
+# DuckDuckGo lite lists each result as a result-link anchor followed by a
+# result-snippet cell, so one scan over both yields the results in order
+_DDG_RESULT_RE = re.compile(
+    r"""<a\b(?P<link_attrs>[^>]*\bclass=['"]result-link['"][^>]*)>(?P<title>.*?)</a>"""
+    r"""|<td\b[^>]*\bclass=['"]result-snippet['"][^>]*>(?P<snippet>.*?)</td>""",
+    re.DOTALL | re.IGNORECASE
+)
+_HREF_RE = re.compile(r"""\bhref=(['"])(.*?)\1""", re.DOTALL | re.IGNORECASE)
+_TAG_RE = re.compile(r'<[^>]+>')
+
+
+def _html_to_text(fragment: str) -> str:
+    """Strip tags from an HTML fragment and collapse its whitespace."""
+    return _WS_RE.sub(' ', html.unescape(_TAG_RE.sub(' ', fragment))).strip()
+
+
+def _parse_ddg_results(page: str, max_results: int) -> List[Dict[str, str]]:
+    """
+    Parse DuckDuckGo lite results with a single regex scan.
+
+    Args:
+        page: DuckDuckGo lite results page
+        max_results: Maximum number of results to return
+
+    Returns:
+        List of search results with title, url, and snippet
+    """
+    results = []
+    link = None  # (title, href) waiting for its snippet
+
+    for match in _DDG_RESULT_RE.finditer(page):
+        if match.group('title') is not None:
+            href = _HREF_RE.search(match.group('link_attrs'))
+            link = (match.group('title'), html.unescape(href.group(2)) if href else '')
+            continue
+
+        if link is None:
+            continue
+        title, href = link
+        link = None
+
+        if href and not href.startswith('/'):
+            results.append({
+                "title": _html_to_text(title),
+                "url": href,
+                "snippet": _html_to_text(match.group('snippet'))
+            })
+
+            if len(results) >= max_results:
+                break
+
+    return results
+
+
+def _parse_ddg_results_tree(page: str, max_results: int) -> List[Dict[str, str]]:
+    """
+    Parse DuckDuckGo lite results by walking the parsed HTML tree.
+
+    Args:
+        page: DuckDuckGo lite results page
+        max_results: Maximum number of results to return
+
+    Returns:
+        List of search results with title, url, and snippet
+    """
+    tree = LexborHTMLParser(page)
+    results = []
+
+    # Parse search results from DuckDuckGo lite
+    result_tables = tree.css('tr')
+
+    for table_row in result_tables[:max_results * 2]:  # Get more rows to filter
+        link = table_row.css_first('a.result-link')
+        snippet_td = table_row.css_first('td.result-snippet')
+
+        if link and snippet_td:
+            title = link.text(strip=True)
+            href = link.attributes.get('href') or ''
+            snippet = snippet_td.text(strip=True)
+
+            if href and not href.startswith('/'):
+                results.append({
+                    "title": title,
+                    "url": href,
+                    "snippet": snippet
+                })
+
+                if len(results) >= max_results:
+                    break
+
+    return results
+
 
 class SearchService:
     """Service for performing web searches and extracting content."""
 
-    def __init__(self, timeout: int = 30):
+    def __init__(
+        self,
+        timeout: int = 30,
+        max_concurrency: int = 8,
+        max_page_chars: int = 2_000_000,
+        cache_size: int = 1024,
+        cache_ttl: float = 3600
+    ):
         """
         Initialize the search service.
 
         Args:
             timeout: HTTP request timeout in seconds
+            max_concurrency: Maximum number of pages fetched at once
+            max_page_chars: Stop downloading a page after this many characters
+            cache_size: Maximum number of cached searches and pages (0 disables)
+            cache_ttl: Seconds a cached search or page stays valid
         """
         self.timeout = timeout
+        self.max_page_chars = max_page_chars
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        # LRU of (expiry, value) for search results and extracted pages
+        self._cache: "OrderedDict[Tuple, Tuple[float, Any]]" = OrderedDict()
+        self._fetch_semaphore = asyncio.Semaphore(max_concurrency)
         self.user_agent = "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36"
 
+        # Shared client so connections (and TLS sessions) are reused across
+        # searches and page fetches, multiplexed over HTTP/2 where supported
+        self._client = httpx.AsyncClient(
+            timeout=timeout,
+            http2=True,
+            headers={"User-Agent": self.user_agent},
+            limits=httpx.Limits(max_connections=32, max_keepalive_connections=16)
+        )
+
+    async def aclose(self) -> None:
+        """Close the shared HTTP client."""
+        await self._client.aclose()
+
+    def _cache_get(self, key: Tuple) -> Optional[Any]:
+        """Return a cached value, or None if missing or expired."""
+        entry = self._cache.get(key)
+        if entry is None:
+            return None
+        expires, value = entry
+        if expires < time.monotonic():
+            del self._cache[key]
+            return None
+        self._cache.move_to_end(key)
+        return value
+
+    def _cache_put(self, key: Tuple, value: Any) -> None:
+        """Cache a value, evicting the least recently used entries."""
+        if self.cache_size <= 0:
+            return
+        self._cache[key] = (time.monotonic() + self.cache_ttl, value)
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
     async def search_duckduckgo(
         self,
         query: str,
@@ -42,43 +218,29 @@ class SearchService:
         Returns:
             List of search results with title, url, and snippet
         """
+        cache_key = ("search", query.lower().strip(), max_results)
+        cached = self._cache_get(cache_key)
+        if cached is not None:
+            # Copies, since callers add extracted content to the results
+            return [dict(result) for result in cached]
+
         try:
             # Use DuckDuckGo lite HTML version (easier to parse)
             encoded_query = quote_plus(query)
             url = f"https://lite.duckduckgo.com/lite/?q={encoded_query}"
 
-            async with httpx.AsyncClient(timeout=self.timeout) as client:
-                headers = {"User-Agent": self.user_agent}
-                response = await client.get(url, headers=headers)
-                response.raise_for_status()
-
-                soup = BeautifulSoup(response.text, 'html.parser')
-                results = []
+            response = await self._client.get(url)
+            response.raise_for_status()
 
-                # Parse search results from DuckDuckGo lite
-                result_tables = soup.find_all('tr')
+            results = _parse_ddg_results(response.text, max_results)
+            if not results:
+                # Fall back to walking the tree in case the markup changed
+                results = _parse_ddg_results_tree(response.text, max_results)
 
-                for table_row in result_tables[:max_results * 2]:  # Get more rows to filter
-                    link = table_row.find('a', class_='result-link')
-                    snippet_td = table_row.find('td', class_='result-snippet')
-
-                    if link and snippet_td:
-                        title = link.get_text(strip=True)
-                        href = link.get('href', '')
-                        snippet = snippet_td.get_text(strip=True)
-
-                        if href and not href.startswith('/'):
-                            results.append({
-                                "title": title,
-                                "url": href,
-                                "snippet": snippet
-                            })
-
-                            if len(results) >= max_results:
-                                break
-
-                logger.info(f"Found {len(results)} results for query: {query}")
-                return results
+            logger.info(f"Found {len(results)} results for query: {query}")
+            if results:
+                self._cache_put(cache_key, [dict(result) for result in results])
+            return results
 
         except Exception as e:
             logger.error(f"Error searching DuckDuckGo: {e}")
@@ -99,13 +261,13 @@ class SearchService:
         Returns:
             Extracted text content or None if failed
         """
+        cache_key = ("page", _canonical_url(url), max_length)
+        cached = self._cache_get(cache_key)
+        if cached is not None:
+            return cached
+
         try:
-            async with httpx.AsyncClient(
-                timeout=self.timeout,
-                follow_redirects=True
-            ) as client:
-                headers = {"User-Agent": self.user_agent}
-                response = await client.get(url, headers=headers)
+            async with self._client.stream('GET', url, follow_redirects=True) as response:
                 response.raise_for_status()
 
                 # Only process HTML content
@@ -114,24 +276,35 @@ class SearchService:
                     logger.warning(f"Skipping non-HTML content: {content_type}")
                     return None
 
-                soup = BeautifulSoup(response.text, 'html.parser')
+                # Read the body incrementally so very large pages aren't
+                # downloaded in full just to be truncated
+                chunks = []
+                size = 0
+                async for chunk in response.aiter_text():
+                    chunks.append(chunk)
+                    size += len(chunk)
+                    if size >= self.max_page_chars:
+                        break
+
+            tree = LexborHTMLParser(''.join(chunks))
 
-                # Remove script and style elements
-                for script in soup(['script', 'style', 'header', 'footer', 'nav']):
-                    script.decompose()
+            # Remove script and style elements
+            tree.strip_tags(['script', 'style', 'header', 'footer', 'nav'])
 
-                # Get text content
-                text = soup.get_text(separator=' ', strip=True)
+            # Get text content from the whole document, so <title> and other
+            # text outside <body> is kept as it was with BeautifulSoup
+            text = tree.root.text(separator=' ', strip=True) if tree.root else ''
 
-                # Clean up whitespace
-                text = re.sub(r'\s+', ' ', text)
+            # Clean up whitespace
+            text = _WS_RE.sub(' ', text)
 
-                # Truncate if too long
-                if len(text) > max_length:
-                    text = text[:max_length] + "..."
+            # Truncate if too long
+            if len(text) > max_length:
+                text = text[:max_length] + "..."
 
-                logger.info(f"Extracted {len(text)} characters from {url}")
-                return text
+            logger.info(f"Extracted {len(text)} characters from {url}")
+            self._cache_put(cache_key, text)
+            return text
 
         except Exception as e:
             logger.error(f"Error extracting content from {url}: {e}")
@@ -160,9 +333,10 @@ class SearchService:
         if not extract_content or not results:
             return results
 
-        # Extract content from URLs in parallel
+        # Extract content from URLs in parallel, a bounded number at a time
         async def fetch_and_add_content(result):
-            content = await self.extract_content_from_url(result['url'])
+            async with self._fetch_semaphore:
+                content = await self.extract_content_from_url(result['url'])
             result['extracted_content'] = content
             return result
 
@@ -234,3 +408,11 @@ def get_search_service() -> SearchService:
     if _search_service is None:
         _search_service = SearchService()
     return _search_service
+
+
+async def shutdown_search_service() -> None:
+    """Close the global search service so the next get creates a fresh one."""
+    global _search_service
+    service, _search_service = _search_service, None
+    if service is not None:
+        await service.aclose()
@@ -1,6 +1,11 @@
 import streamlit as st
 import requests
 import os
+import orjson
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from requests_toolbelt.multipart.encoder import MultipartEncoder, MultipartEncoderMonitor
 from dotenv import load_dotenv
 
 # Load environment variables
@@ -9,38 +14,121 @@ load_dotenv()
 # Configuration
 API_URL = os.getenv("API_URL", "http://localhost:8000/api/v1")
 
+# (connect, read) timeouts in seconds. Generation and upload processing run
+# the LLM / embedding pipeline server-side, so they get a longer read timeout.
+REQUEST_TIMEOUT = (3.05, 30)
+PROCESSING_TIMEOUT = (3.05, 300)
+
+JSON_HEADERS = {"Content-Type": "application/json"}
+
+# Search results rendered per "Show more" click, and how many of them start expanded
+RESULTS_PAGE_SIZE = 10
+RESULTS_EXPANDED = 3
+
+# Characters of an uploaded document's converted content shown inline.
+# The full content is offered as a download instead.
+UPLOAD_PREVIEW_CHARS = 50_000
+
+# Uploads are checked against these before anything is sent
+MAX_UPLOAD_BYTES = 200 * 1024 * 1024
+ALLOWED_UPLOAD_TYPES = {"application/pdf", "text/plain", "text/html"}
+
+# Concurrent uploads when several files are selected
+UPLOAD_WORKERS = 6
+
 st.set_page_config(
     page_title="Document Hub Search",
     page_icon="🔍",
     layout="wide"
 )
 
+def _loads(data):
+    # orjson parses large search/answer payloads several times faster than
+    # the stdlib json behind response.json(). Errors are re-raised as the
+    # requests exception response.json() would have raised.
+    try:
+        return orjson.loads(data)
+    except orjson.JSONDecodeError as e:
+        raise requests.exceptions.JSONDecodeError(e.msg, e.doc, e.pos) from e
+
+@st.cache_resource
+def get_session():
+    # Streamlit re-executes this script on every rerun, so the session is kept
+    # as a cached resource to reuse its connection pool across reruns
+    session = requests.Session()
+    # Retry transient gateway errors. urllib3 only retries idempotent
+    # methods, so POSTs are never sent twice.
+    adapter = HTTPAdapter(
+        pool_connections=10,
+        pool_maxsize=20,
+        max_retries=Retry(total=2, backoff_factor=0.2, status_forcelist=[502, 503, 504])
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+# Results are cached per set of arguments so reruns triggered by unrelated
+# widgets don't hit the API again. Errors raise, and are therefore not cached.
+@st.cache_data(ttl=300, show_spinner=False)
+def _fetch_search(query, search_type, limit, min_score):
+    params = {
+        "q": query,
+        "type": search_type,
+        "limit": limit,
+        "min_score": min_score
+    }
+    response = get_session().get(f"{API_URL}/search", params=params, timeout=REQUEST_TIMEOUT)
+    response.raise_for_status()
+    return _loads(response.content)
+
+# Generation is the slowest and costliest call, so answers are kept longer.
+# The Regenerate button clears the entry for the current arguments.
+@st.cache_data(ttl=3600, show_spinner=False)
+def _fetch_answer(prompt, limit, min_score, include_citations):
+    payload = {
+        "prompt": prompt,
+        "limit": limit,
+        "min_score": min_score,
+        "include_citations": include_citations
+    }
+    response = get_session().post(
+        f"{API_URL}/generate",
+        data=orjson.dumps(payload),
+        headers=JSON_HEADERS,
+        timeout=PROCESSING_TIMEOUT
+    )
+    response.raise_for_status()
+    return _loads(response.content)
+
 def search_documents(query, search_type, limit, min_score):
     try:
-        params = {
-            "q": query,
-            "type": search_type,
-            "limit": limit,
-            "min_score": min_score
-        }
-        response = requests.get(f"{API_URL}/search", params=params)
-        response.raise_for_status()
-        return response.json()
+        return _fetch_search(query, search_type, limit, min_score)
     except requests.exceptions.RequestException as e:
         st.error(f"Error connecting to API: {e}")
         return None
 
+def _result_rows(results):
+    # Extract the displayed fields of each search result in one pass. The
+    # content fallback is only sliced when the API sent no snippet.
+    return [
+        (
+            doc.get('title', 'Untitled Document'),
+            result.get('score', 0.0),
+            doc.get('id', 'Unknown'),
+            result.get('snippet') or doc.get('content', '')[:200] + "...",
+            doc.get('metadata', {})
+        )
+        # Handle potential nesting of document fields
+        for result in results
+        for doc in (result.get('document', result),)
+    ]
+
+def _show_more_results():
+    st.session_state["results_shown"] = st.session_state.get("results_shown", RESULTS_PAGE_SIZE) + RESULTS_PAGE_SIZE
+
 def generate_answer(prompt, limit, min_score, include_citations):
     try:
-        payload = {
-            "prompt": prompt,
-            "limit": limit,
-            "min_score": min_score,
-            "include_citations": include_citations
-        }
-        response = requests.post(f"{API_URL}/generate", json=payload)
-        response.raise_for_status()
-        return response.json()
+        return _fetch_answer(prompt, limit, min_score, include_citations)
     except requests.exceptions.RequestException as e:
         if hasattr(e, 'response') and e.response is not None:
              try:
@@ -52,16 +140,213 @@ def generate_answer(prompt, limit, min_score, include_citations):
             st.error(f"Error connecting to API: {e}")
         return None
 
+def _post_document(session, file, on_progress=None):
+    # Stream the multipart body from the uploaded file instead of building
+    # it in memory. No st.* calls here, so it can run on worker threads.
+    file.seek(0)
+    encoder = MultipartEncoder(fields={"file": (file.name, file, file.type)})
+    monitor = MultipartEncoderMonitor(encoder, on_progress)
+    response = session.post(
+        f"{API_URL}/documents/upload",
+        data=monitor,
+        headers={"Content-Type": monitor.content_type},
+        timeout=PROCESSING_TIMEOUT
+    )
+    response.raise_for_status()
+    return _loads(response.content)
+
+def _validate_upload(file):
+    # Returns why the file can't be uploaded, or None. The uploader filters
+    # by extension only, so the reported MIME type is checked as well.
+    if file.size > MAX_UPLOAD_BYTES:
+        return f"File exceeds {MAX_UPLOAD_BYTES // (1024 * 1024)} MB limit"
+    if file.type not in ALLOWED_UPLOAD_TYPES:
+        return f"Unsupported file type: {file.type}"
+    return None
+
 def upload_document(file):
+    error = _validate_upload(file)
+    if error:
+        st.error(f"Error uploading document: {error}")
+        return None
     try:
-        files = {"file": (file.name, file, file.type)}
-        response = requests.post(f"{API_URL}/documents/upload", files=files)
-        response.raise_for_status()
-        return response.json()
+        progress_bar = st.progress(0.0, text=f"Sending {file.name}...")
+        result = _post_document(
+            get_session(),
+            file,
+            lambda m: progress_bar.progress(min(m.bytes_read / m.len, 1.0), text=f"Sending {file.name}...")
+        )
+        progress_bar.empty()
+        return result
     except requests.exceptions.RequestException as e:
         st.error(f"Error uploading document: {e}")
         return None
 
+def _render_upload_result(container, name, result, key):
+    # The response carries the whole converted document. Rendering it in
+    # st.json puts all of it in the page, so only a preview is shown.
+    content = result.get("content") or ""
+    container.json({k: v for k, v in result.items() if k != "content"})
+    if content:
+        preview = content[:UPLOAD_PREVIEW_CHARS]
+        if len(content) > UPLOAD_PREVIEW_CHARS:
+            preview += "\n\n… (truncated, use Download for full)"
+        container.code(preview, language="markdown")
+        container.download_button(
+            "Download full content",
+            data=content,
+            file_name=f"{os.path.splitext(name)[0]}.md",
+            mime="text/markdown",
+            key=key
+        )
+
+def upload_documents(files):
+    # Uploads run concurrently on the shared session's connection pool and
+    # are yielded as (index, result, error) in completion order. The session
+    # is fetched here because worker threads have no Streamlit script context.
+    session = get_session()
+    with ThreadPoolExecutor(max_workers=UPLOAD_WORKERS) as executor:
+        futures = {}
+        for i, file in enumerate(files):
+            error = _validate_upload(file)
+            if error:
+                yield i, None, error
+            else:
+                futures[executor.submit(_post_document, session, file)] = i
+        for future in as_completed(futures):
+            try:
+                yield futures[future], future.result(), None
+            except requests.exceptions.RequestException as e:
+                yield futures[future], None, e
+
+# Each tab body is a fragment, so interacting with one tab's widgets reruns
+# only that tab. Sidebar changes still rerun the whole page.
+@st.fragment
+def _search_tab(limit, min_score):
+    st.header("Search Documents")
+    # The form only reruns the search on submit, not on every keystroke
+    # or sidebar change
+    with st.form("search_form"):
+        search_type = st.selectbox(
+            "Search Type",
+            ["hybrid", "semantic", "fulltext"],
+            index=0,
+            help="Hybrid combines keyword and semantic search for best results."
+        )
+        query = st.text_input("Enter your search query...", placeholder="e.g., 'How to configure postgres?'", key="search_query")
+        submitted = st.form_submit_button("Search", type="primary")
+    
+    if submitted:
+        if not query:
+            st.warning("Please enter a search query.")
+            st.session_state.pop("search_args", None)
+        else:
+            st.session_state["search_args"] = (query, search_type, limit, min_score)
+            st.session_state["results_shown"] = RESULTS_PAGE_SIZE
+    
+    # The last submitted search stays on screen across reruns, served
+    # from the search cache
+    if "search_args" in st.session_state:
+        with st.spinner("Searching..."):
+            results = search_documents(*st.session_state["search_args"])
+
+        if results and "results" in results:
+            count = results.get("count", 0)
+            st.success(f"Found {count} results")
+            
+            # Only the first page of results is rendered, the rest on demand
+            rows = _result_rows(results["results"])
+            shown = st.session_state.get("results_shown", RESULTS_PAGE_SIZE)
+            for i, (title, score, document_id, snippet, metadata) in enumerate(rows[:shown]):
+                with st.expander(f"{title} (Score: {score:.2f})", expanded=i < RESULTS_EXPANDED):
+                    st.markdown(f"**Document ID:** {document_id}")
+                    st.markdown("### Content Snippet")
+                    st.markdown(snippet)
+                    
+                    if metadata:
+                        st.markdown("### Metadata")
+                        st.json(metadata)
+            
+            if shown < len(rows):
+                st.button(
+                    f"Show more ({len(rows) - shown} remaining)",
+                    key="show_more_btn",
+                    on_click=_show_more_results
+                )
+        elif results:
+             st.info("No results found matching your criteria.")
+
+@st.fragment
+def _ask_tab(limit, min_score):
+    st.header("Ask AI")
+    st.markdown("Generate answers based on your documents.")
+    
+    prompt = st.text_area("Enter your question...", placeholder="e.g., 'Create a summary of the project architecture'", height=100)
+    include_citations = st.checkbox("Include Citations", value=True)
+    
+    generate = st.button("Generate Answer", type="primary", key="gen_btn")
+    regenerate = st.button("Regenerate", key="regen_btn", help="Ignore the cached answer for this question and settings.")
+    
+    if generate or regenerate:
+        if not prompt:
+            st.warning("Please enter a question.")
+        else:
+            if regenerate:
+                _fetch_answer.clear(prompt, limit, min_score, include_citations)
+            with st.spinner("Generating answer... (this may take a moment)"):
+                response = generate_answer(prompt, limit, min_score, include_citations)
+            
+            if response:
+                st.session_state["last_generation"] = {"prompt": prompt, "response": response}
+    
+    # The last answer is re-rendered on every rerun, so other interactions
+    # don't make it disappear and invite another generation
+    if "last_generation" in st.session_state:
+        response = st.session_state["last_generation"]["response"]
+        st.markdown("### 🤖 Generated Answer")
+        st.markdown(response.get("generated_text", "No answer generated."))
+        
+        if response.get("sources"):
+            with st.expander("📚 Sources Used"):
+                for i, source in enumerate(response["sources"]):
+                    doc = source.get('document', source)
+                    st.markdown(f"**{i+1}. {doc.get('title', 'Untitled')}** (Score: {source.get('score', 0):.2f})")
+
+@st.fragment
+def _upload_tab():
+    st.header("Upload Documents")
+    st.markdown("Upload PDF, Text, or HTML files to the knowledge base.")
+    
+    uploaded_files = st.file_uploader("Choose files", type=['pdf', 'txt', 'html'], accept_multiple_files=True)
+    
+    if len(uploaded_files) == 1:
+        uploaded_file = uploaded_files[0]
+        st.info(f"File selected: {uploaded_file.name} ({uploaded_file.type})")
+        
+        if st.button("Upload File", type="primary", key="upload_btn"):
+            with st.spinner("Uploading and processing..."):
+                result = upload_document(uploaded_file)
+            
+            if result:
+                st.success(f"File '{uploaded_file.name}' uploaded successfully!")
+                _render_upload_result(st, uploaded_file.name, result, "download_0")
+    elif uploaded_files:
+        st.info(f"{len(uploaded_files)} files selected")
+        
+        if st.button("Upload Files", type="primary", key="upload_btn"):
+            statuses = [
+                st.status(f"Uploading {f.name}...", state="running")
+                for f in uploaded_files
+            ]
+            for i, result, error in upload_documents(uploaded_files):
+                name = uploaded_files[i].name
+                if error is not None:
+                    statuses[i].update(label=f"Failed to upload {name}", state="error")
+                    statuses[i].error(f"Error uploading document: {error}")
+                else:
+                    statuses[i].update(label=f"File '{name}' uploaded successfully!", state="complete")
+                    _render_upload_result(statuses[i], name, result, f"download_{i}")
+
 def main():
     st.title("🔍 Document Hub")
     st.markdown("Search documents, ask questions, or upload new content.")
@@ -81,86 +366,13 @@ def main():
     tab1, tab2, tab3 = st.tabs(["🔎 Search", "✨ Ask AI", "📤 Upload"])
 
     with tab1:
-        st.header("Search Documents")
-        search_type = st.selectbox(
-            "Search Type",
-            ["hybrid", "semantic", "fulltext"],
-            index=0,
-            help="Hybrid combines keyword and semantic search for best results."
-        )
-        query = st.text_input("Enter your search query...", placeholder="e.g., 'How to configure postgres?'", key="search_query")
-        
-        if st.button("Search", type="primary", key="search_btn") or query:
-            if not query:
-                st.warning("Please enter a search query.")
-            else:
-                with st.spinner("Searching..."):
-                    results = search_documents(query, search_type, limit, min_score)
-
-                if results and "results" in results:
-                    count = results.get("count", 0)
-                    st.success(f"Found {count} results")
-                    
-                    for result in results["results"]:
-                        # Handle potential nesting of document fields
-                        doc = result.get('document', result)
-                        title = doc.get('title', 'Untitled Document')
-                        score = result.get('score', 0.0)
-                        content = doc.get('content', '')
-                        metadata = doc.get('metadata', {})
-                        document_id = doc.get('id', 'Unknown')
-                        
-                        with st.expander(f"{title} (Score: {score:.2f})", expanded=True):
-                            st.markdown(f"**Document ID:** {document_id}")
-                            st.markdown("### Content Snippet")
-                            st.markdown(result.get('snippet', content[:200] + "..."))
-                            
-                            if metadata:
-                                st.markdown("### Metadata")
-                                st.json(metadata)
-                elif results:
-                     st.info("No results found matching your criteria.")
+        _search_tab(limit, min_score)
 
     with tab2:
-        st.header("Ask AI")
-        st.markdown("Generate answers based on your documents.")
-        
-        prompt = st.text_area("Enter your question...", placeholder="e.g., 'Create a summary of the project architecture'", height=100)
-        include_citations = st.checkbox("Include Citations", value=True)
-        
-        if st.button("Generate Answer", type="primary", key="gen_btn"):
-            if not prompt:
-                st.warning("Please enter a question.")
-            else:
-                with st.spinner("Generating answer... (this may take a moment)"):
-                    response = generate_answer(prompt, limit, min_score, include_citations)
-                
-                if response:
-                    st.markdown("### 🤖 Generated Answer")
-                    st.markdown(response.get("generated_text", "No answer generated."))
-                    
-                    if response.get("sources"):
-                        with st.expander("📚 Sources Used"):
-                            for i, source in enumerate(response["sources"]):
-                                doc = source.get('document', source)
-                                st.markdown(f"**{i+1}. {doc.get('title', 'Untitled')}** (Score: {source.get('score', 0):.2f})")
+        _ask_tab(limit, min_score)
 
     with tab3:
-        st.header("Upload Document")
-        st.markdown("Upload PDF, Text, or HTML files to the knowledge base.")
-        
-        uploaded_file = st.file_uploader("Choose a file", type=['pdf', 'txt', 'html'])
-        
-        if uploaded_file is not None:
-            st.info(f"File selected: {uploaded_file.name} ({uploaded_file.type})")
-            
-            if st.button("Upload File", type="primary", key="upload_btn"):
-                with st.spinner("Uploading and processing..."):
-                    result = upload_document(uploaded_file)
-                
-                if result:
-                    st.success(f"File '{uploaded_file.name}' uploaded successfully!")
-                    st.json(result)
+        _upload_tab()
 
 if __name__ == "__main__":
     main()